@@ -1,7 +1,13 @@
 import asyncio
 import html
+import io
 import os
+import sys
+import threading
 import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 from decimal import Decimal, InvalidOperation
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from threading import Thread
@@ -31,6 +37,98 @@ PREDICT_API_KEY = os.getenv("API", "")
 PREDICT_ACCOUNT = os.getenv("PREDICT_ACCOUNT", "")
 PREDICT_BASE_URL = os.getenv("PREDICT_BASE_URL", "https://api.predict.fun")
 
+PERF_RING_SIZE = int(os.getenv("PERF_RING_SIZE", "200"))
+PERF_SAMPLE_INTERVAL = 0.01
+PERF_MAX_PROFILE_SECONDS = 120
+
+
+class PerfCycle:
+    """Один прогон (цикл монитора, /bids, отмена) с временем по стадиям."""
+
+    def __init__(self, name: str):
+        self.name       = name
+        self.started_at = time.time()
+        self.duration   = 0.0
+        self.stages: dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+_perf_cycles: deque[PerfCycle] = deque(maxlen=PERF_RING_SIZE)
+_perf_current: ContextVar[PerfCycle | None] = ContextVar("perf_current", default=None)
+_perf_profiling = False
+
+
+@contextmanager
+def perf_cycle(name: str):
+    cycle = PerfCycle(name)
+    token = _perf_current.set(cycle)
+    start = time.perf_counter()
+    try:
+        yield cycle
+    finally:
+        cycle.duration = time.perf_counter() - start
+        _perf_current.reset(token)
+        _perf_cycles.append(cycle)
+
+
+@contextmanager
+def perf_span(stage: str):
+    """Суммирует время стадии в текущий цикл; вне цикла ничего не делает."""
+    cycle = _perf_current.get()
+    if cycle is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        cycle.add(stage, time.perf_counter() - start)
+
+
+def format_perf_message(limit: int = 5) -> str:
+    cycles = list(_perf_cycles)
+    if not cycles:
+        return "No traced cycles yet."
+
+    slowest = sorted(cycles, key=lambda c: c.duration, reverse=True)[:limit]
+    lines = [f"Slowest cycles ({len(slowest)} of {len(cycles)} recent):"]
+    for idx, cycle in enumerate(slowest, start=1):
+        stages = dict(cycle.stages)
+        other = cycle.duration - sum(stages.values())
+        if other >= 0.001:
+            stages["other"] = other
+        stage_text = " | ".join(f"{name} {seconds:.3f}s" for name, seconds in stages.items()) or "-"
+        started = time.strftime("%H:%M:%S", time.localtime(cycle.started_at))
+        lines.append(
+            f"{idx}. <b>{html.escape(cycle.name)}</b> {cycle.duration:.3f}s @ {started}\n"
+            f"<code>{html.escape(stage_text)}</code>"
+        )
+    return "\n\n".join(lines)
+
+
+def sample_stacks(seconds: float, interval: float = PERF_SAMPLE_INTERVAL) -> str:
+    """Сэмплирует стеки всех потоков и возвращает их в collapsed-формате (для flamegraph)."""
+    own_id = threading.get_ident()
+    counts: dict[str, int] = {}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
 class JWTManager:
     REFRESH_BEFORE_EXPIRY = 1 * 60
 
@@ -396,179 +494,198 @@ async def fetch(session, url):
 async def bids_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ALLOWED_USER_ID:
         return  # молча игнорируем чужие запросы
-    notifications = []
-    async with aiohttp.ClientSession() as session:
-        orders_data = await fetch(session, "https://api.predict.fun/v1/orders")
-        orders = orders_data.get("data", [])
-        if not orders:
-            await update.message.reply_text("Ордеров не найдено.")
-            return
-        market_ids = list(set(o["marketId"] for o in orders))
-        orderbook_tasks = [fetch(session, f"https://api.predict.fun/v1/markets/{m_id}/orderbook") for m_id in market_ids]
-        market_info_tasks = [fetch(session, f"https://api.predict.fun/v1/markets/{m_id}") for m_id in market_ids]
-        results = await asyncio.gather(*orderbook_tasks, *market_info_tasks)
-        n = len(market_ids)
-        orderbooks = {market_ids[i]: results[i]["data"] for i in range(n)}
-        titles = {market_ids[i]: results[i+n]["data"] for i in range(n)}
-        for o in orders:
-            m_id = o["marketId"]
-            orderbook_data = orderbooks[m_id]
-            title_data = titles[m_id]
-            question = title_data["question"]
-            analyze = analyze_order(o, orderbook_data)
-            maker_amt = float(o["order"]["makerAmount"])
-            taker_amt = float(o["order"]["takerAmount"])
-            my_price = maker_amt / taker_amt
-            my_shares = taker_amt / 1e18
-            my_usd = my_price * my_shares
-            if analyze["likely_outcome"] == "YES":
-                bids = orderbook_data.get("bids", [])
-            else:
-                no_book = transform_to_no_orderbook(orderbook_data, precision=3)
-                bids = no_book.get("no_bids", [])
-            higher = [b for b in bids if b[0] > my_price]
-            lower = [b for b in bids if b[0] <= my_price][:3]
-            quote_lines = []
-            for price, shares in higher:
-                quote_lines.append(f"{price*100:>6.2f}¢ | {shares:>8.2f} sh | ${price * shares:>8.2f}")
-            
-            quote_lines.append(f"<b>▶ {my_price*100:>6.2f}¢ | {my_shares:>8.2f} sh | ${my_usd:>8.2f} ← YOUR ORDER</b>")
-            
-            for price, shares in lower:
-                quote_lines.append(f"{price*100:>6.2f}¢ | {shares:>8.2f} sh | ${price * shares:>8.2f}")
-            
-            quote_text = "\n".join(quote_lines)
-            notifications.append(
-                f"<code>{question}</code>\n"
-                f"<blockquote>{quote_text}</blockquote>\n\n"
-            )
-    full_message = "".join(notifications)
-    if len(full_message) > 4000:
-        for i in range(0, len(full_message), 4000):
-            await update.message.reply_text(full_message[i:i+4000], parse_mode="HTML")
-    else:
-        await update.message.reply_text(full_message, parse_mode="HTML")
-
-async def monitor_single_bid_above(application):
-    """Фоновая задача: уведомляет если выше моего bid только 1 bid."""
-    try:
+    with perf_cycle("bids"):
+        notifications = []
         async with aiohttp.ClientSession() as session:
-            orders_data = await fetch(session, f"{PREDICT_BASE_URL}/v1/orders")
+            with perf_span("jwt"):
+                await jwt_manager.get_headers()
+            with perf_span("orders"):
+                orders_data = await fetch(session, "https://api.predict.fun/v1/orders")
             orders = orders_data.get("data", [])
             if not orders:
+                with perf_span("send"):
+                    await update.message.reply_text("Ордеров не найдено.")
                 return
-
             market_ids = list(set(o["marketId"] for o in orders))
-            orderbook_tasks = [
-                fetch(session, f"{PREDICT_BASE_URL}/v1/markets/{m_id}/orderbook")
-                for m_id in market_ids
-            ]
-            market_info_tasks = [
-                fetch(session, f"{PREDICT_BASE_URL}/v1/markets/{m_id}")
-                for m_id in market_ids
-            ]
-            results = await asyncio.gather(*orderbook_tasks, *market_info_tasks)
+            orderbook_tasks = [fetch(session, f"https://api.predict.fun/v1/markets/{m_id}/orderbook") for m_id in market_ids]
+            market_info_tasks = [fetch(session, f"https://api.predict.fun/v1/markets/{m_id}") for m_id in market_ids]
+            with perf_span("orderbooks"):
+                results = await asyncio.gather(*orderbook_tasks, *market_info_tasks)
             n = len(market_ids)
             orderbooks = {market_ids[i]: results[i]["data"] for i in range(n)}
-            titles = {market_ids[i]: results[i + n]["data"] for i in range(n)}
-
-            active_order_ids = set()
-
+            titles = {market_ids[i]: results[i+n]["data"] for i in range(n)}
             for o in orders:
-                order_id = o.get("id") or o.get("hash") or str(o)
-                active_order_ids.add(order_id)
                 m_id = o["marketId"]
                 orderbook_data = orderbooks[m_id]
-
-                analyze = analyze_order(o, orderbook_data)
-                maker_amt = float(o["order"]["makerAmount"])
-                taker_amt = float(o["order"]["takerAmount"])
-                my_price = maker_amt / taker_amt
-                my_shares = taker_amt / 1e18
-                my_usd = my_price * my_shares
-
-                if analyze["likely_outcome"] == "YES":
-                    bids = orderbook_data.get("bids", [])
-                else:
-                    no_book = transform_to_no_orderbook(orderbook_data, precision=3)
-                    bids = no_book.get("no_bids", [])
-
-                higher = [b for b in bids if b[0] > my_price]
-                my_price_rounded = round(my_price, 3)
-                same_level = next((b for b in bids if round(b[0], 3) == my_price_rounded), None)
-                same_level_shares = same_level[1] if same_level else my_shares
-                same_level_usd = my_price * same_level_shares
-
-                # Сбрасываем флаг если прошло 30 минут и ордер всё ещё активен
-                if order_id in _notified_orders:
-                    elapsed = time.time() - _notified_orders[order_id]
-                    if elapsed >= NOTIFY_RESET_SECONDS:
-                        del _notified_orders[order_id]
-
-                # Отправляем уведомление если выше ровно 1 bid и ещё не уведомляли
-                if len(higher) == 1 and order_id not in _notified_orders:
-                    question = titles[m_id].get("question", f"Market {m_id}")
-                    top_bid_price, top_bid_shares = higher[0]
-                    msg = (
-                        f"⚠️ <b>Только 1 bid выше вашего!</b>\n\n"
-                        f"<code>{html.escape(question)}</code>\n\n"
-                        f"Top bid: {top_bid_price * 100:.2f}¢ | {top_bid_shares:.2f} sh | ${top_bid_price * top_bid_shares:.2f}\n"
-                        f"My bid: {my_price * 100:.2f}¢ | {my_shares:.2f} sh | ${my_usd:.2f}\n"
-                        f"Total on: {my_price * 100:.2f}¢ | {same_level_shares:.2f} sh | ${same_level_usd:.2f}\n"
-                        f"Order ID: <code>{html.escape(str(order_id))}</code>"
+                title_data = titles[m_id]
+                question = title_data["question"]
+                with perf_span("analyze"):
+                    analyze = analyze_order(o, orderbook_data)
+                    maker_amt = float(o["order"]["makerAmount"])
+                    taker_amt = float(o["order"]["takerAmount"])
+                    my_price = maker_amt / taker_amt
+                    my_shares = taker_amt / 1e18
+                    my_usd = my_price * my_shares
+                    if analyze["likely_outcome"] == "YES":
+                        bids = orderbook_data.get("bids", [])
+                    else:
+                        no_book = transform_to_no_orderbook(orderbook_data, precision=3)
+                        bids = no_book.get("no_bids", [])
+                    higher = [b for b in bids if b[0] > my_price]
+                    lower = [b for b in bids if b[0] <= my_price][:3]
+                with perf_span("format"):
+                    quote_lines = []
+                    for price, shares in higher:
+                        quote_lines.append(f"{price*100:>6.2f}¢ | {shares:>8.2f} sh | ${price * shares:>8.2f}")
+
+                    quote_lines.append(f"<b>▶ {my_price*100:>6.2f}¢ | {my_shares:>8.2f} sh | ${my_usd:>8.2f} ← YOUR ORDER</b>")
+
+                    for price, shares in lower:
+                        quote_lines.append(f"{price*100:>6.2f}¢ | {shares:>8.2f} sh | ${price * shares:>8.2f}")
+
+                    quote_text = "\n".join(quote_lines)
+                    notifications.append(
+                        f"<code>{question}</code>\n"
+                        f"<blockquote>{quote_text}</blockquote>\n\n"
                     )
-                    # Формируем inline-клавиатуру
-                    keyboard = InlineKeyboardMarkup([
-                        [
-                            InlineKeyboardButton("❌ Отменить этот ордер", callback_data=f"cancel_one:{order_id}"),
-                            InlineKeyboardButton("🗑 Отменить все", callback_data="cancel_all"),
-                        ]
-                    ])
-
-                    await application.bot.send_message(
-                        chat_id=ALLOWED_USER_ID,
-                        text=msg,
-                        parse_mode="HTML",
-                        reply_markup=keyboard,
-                    )
-                    _notified_orders[order_id] = time.time()
-                # Сбрасываем флаг для "0 выше" если прошло 30 минут
-                if order_id in _notified_zero_above:
-                    elapsed = time.time() - _notified_zero_above[order_id]
-                    if elapsed >= NOTIFY_RESET_SECONDS:
-                        del _notified_zero_above[order_id]
-
-                # Уведомление если выше 0 bids
-                if len(higher) == 0 and order_id not in _notified_zero_above:
-                    question = titles[m_id].get("question", f"Market {m_id}")
-                    msg = (
-                        f"🔴 <b>Вы первый в очереди! Нет bids выше вашего.</b>\n\n"
-                        f"<code>{html.escape(question)}</code>\n\n"
-                        f"My bid: {my_price * 100:.2f}¢ | {my_shares:.2f} sh | ${my_usd:.2f}\n"
-                        f"Total on {my_price * 100:.2f}¢: {same_level_shares:.2f} sh | ${same_level_usd:.2f}\n"
-                        f"Order ID: <code>{html.escape(str(order_id))}</code>"
-                    )
-                    keyboard = InlineKeyboardMarkup([
-                        [
-                            InlineKeyboardButton("❌ Отменить этот ордер", callback_data=f"cancel_one:{order_id}"),
-                            InlineKeyboardButton("🗑 Отменить все", callback_data="cancel_all"),
-                        ]
-                    ])
-                    await application.bot.send_message(
-                        chat_id=ALLOWED_USER_ID,
-                        text=msg,
-                        parse_mode="HTML",
-                        reply_markup=keyboard,
-                    )
-                    _notified_zero_above[order_id] = time.time()
+        full_message = "".join(notifications)
+        with perf_span("send"):
+            if len(full_message) > 4000:
+                for i in range(0, len(full_message), 4000):
+                    await update.message.reply_text(full_message[i:i+4000], parse_mode="HTML")
+            else:
+                await update.message.reply_text(full_message, parse_mode="HTML")
 
-            # Чистим словарь от отменённых ордеров
-            for oid in list(_notified_orders.keys()):
-                if oid not in active_order_ids:
-                    del _notified_orders[oid]
-            for oid in list(_notified_zero_above.keys()):  # ← добавить
-                if oid not in active_order_ids:
-                    del _notified_zero_above[oid]
+async def monitor_single_bid_above(application):
+    """Фоновая задача: уведомляет если выше моего bid только 1 bid."""
+    try:
+        with perf_cycle("monitor"):
+            async with aiohttp.ClientSession() as session:
+                with perf_span("jwt"):
+                    await jwt_manager.get_headers()
+                with perf_span("orders"):
+                    orders_data = await fetch(session, f"{PREDICT_BASE_URL}/v1/orders")
+                orders = orders_data.get("data", [])
+                if not orders:
+                    return
+
+                market_ids = list(set(o["marketId"] for o in orders))
+                orderbook_tasks = [
+                    fetch(session, f"{PREDICT_BASE_URL}/v1/markets/{m_id}/orderbook")
+                    for m_id in market_ids
+                ]
+                market_info_tasks = [
+                    fetch(session, f"{PREDICT_BASE_URL}/v1/markets/{m_id}")
+                    for m_id in market_ids
+                ]
+                with perf_span("orderbooks"):
+                    results = await asyncio.gather(*orderbook_tasks, *market_info_tasks)
+                n = len(market_ids)
+                orderbooks = {market_ids[i]: results[i]["data"] for i in range(n)}
+                titles = {market_ids[i]: results[i + n]["data"] for i in range(n)}
+
+                active_order_ids = set()
+
+                for o in orders:
+                    order_id = o.get("id") or o.get("hash") or str(o)
+                    active_order_ids.add(order_id)
+                    m_id = o["marketId"]
+                    orderbook_data = orderbooks[m_id]
+
+                    with perf_span("analyze"):
+                        analyze = analyze_order(o, orderbook_data)
+                        maker_amt = float(o["order"]["makerAmount"])
+                        taker_amt = float(o["order"]["takerAmount"])
+                        my_price = maker_amt / taker_amt
+                        my_shares = taker_amt / 1e18
+                        my_usd = my_price * my_shares
+
+                        if analyze["likely_outcome"] == "YES":
+                            bids = orderbook_data.get("bids", [])
+                        else:
+                            no_book = transform_to_no_orderbook(orderbook_data, precision=3)
+                            bids = no_book.get("no_bids", [])
+
+                        higher = [b for b in bids if b[0] > my_price]
+                        my_price_rounded = round(my_price, 3)
+                        same_level = next((b for b in bids if round(b[0], 3) == my_price_rounded), None)
+                        same_level_shares = same_level[1] if same_level else my_shares
+                        same_level_usd = my_price * same_level_shares
+
+                    # Сбрасываем флаг если прошло 30 минут и ордер всё ещё активен
+                    if order_id in _notified_orders:
+                        elapsed = time.time() - _notified_orders[order_id]
+                        if elapsed >= NOTIFY_RESET_SECONDS:
+                            del _notified_orders[order_id]
+
+                    # Отправляем уведомление если выше ровно 1 bid и ещё не уведомляли
+                    if len(higher) == 1 and order_id not in _notified_orders:
+                        with perf_span("format"):
+                            question = titles[m_id].get("question", f"Market {m_id}")
+                            top_bid_price, top_bid_shares = higher[0]
+                            msg = (
+                                f"⚠️ <b>Только 1 bid выше вашего!</b>\n\n"
+                                f"<code>{html.escape(question)}</code>\n\n"
+                                f"Top bid: {top_bid_price * 100:.2f}¢ | {top_bid_shares:.2f} sh | ${top_bid_price * top_bid_shares:.2f}\n"
+                                f"My bid: {my_price * 100:.2f}¢ | {my_shares:.2f} sh | ${my_usd:.2f}\n"
+                                f"Total on: {my_price * 100:.2f}¢ | {same_level_shares:.2f} sh | ${same_level_usd:.2f}\n"
+                                f"Order ID: <code>{html.escape(str(order_id))}</code>"
+                            )
+                            # Формируем inline-клавиатуру
+                            keyboard = InlineKeyboardMarkup([
+                                [
+                                    InlineKeyboardButton("❌ Отменить этот ордер", callback_data=f"cancel_one:{order_id}"),
+                                    InlineKeyboardButton("🗑 Отменить все", callback_data="cancel_all"),
+                                ]
+                            ])
+
+                        with perf_span("send"):
+                            await application.bot.send_message(
+                                chat_id=ALLOWED_USER_ID,
+                                text=msg,
+                                parse_mode="HTML",
+                                reply_markup=keyboard,
+                            )
+                        _notified_orders[order_id] = time.time()
+                    # Сбрасываем флаг для "0 выше" если прошло 30 минут
+                    if order_id in _notified_zero_above:
+                        elapsed = time.time() - _notified_zero_above[order_id]
+                        if elapsed >= NOTIFY_RESET_SECONDS:
+                            del _notified_zero_above[order_id]
+
+                    # Уведомление если выше 0 bids
+                    if len(higher) == 0 and order_id not in _notified_zero_above:
+                        with perf_span("format"):
+                            question = titles[m_id].get("question", f"Market {m_id}")
+                            msg = (
+                                f"🔴 <b>Вы первый в очереди! Нет bids выше вашего.</b>\n\n"
+                                f"<code>{html.escape(question)}</code>\n\n"
+                                f"My bid: {my_price * 100:.2f}¢ | {my_shares:.2f} sh | ${my_usd:.2f}\n"
+                                f"Total on {my_price * 100:.2f}¢: {same_level_shares:.2f} sh | ${same_level_usd:.2f}\n"
+                                f"Order ID: <code>{html.escape(str(order_id))}</code>"
+                            )
+                            keyboard = InlineKeyboardMarkup([
+                                [
+                                    InlineKeyboardButton("❌ Отменить этот ордер", callback_data=f"cancel_one:{order_id}"),
+                                    InlineKeyboardButton("🗑 Отменить все", callback_data="cancel_all"),
+                                ]
+                            ])
+                        with perf_span("send"):
+                            await application.bot.send_message(
+                                chat_id=ALLOWED_USER_ID,
+                                text=msg,
+                                parse_mode="HTML",
+                                reply_markup=keyboard,
+                            )
+                        _notified_zero_above[order_id] = time.time()
+
+                # Чистим словарь от отменённых ордеров
+                for oid in list(_notified_orders.keys()):
+                    if oid not in active_order_ids:
+                        del _notified_orders[oid]
+                for oid in list(_notified_zero_above.keys()):  # ← добавить
+                    if oid not in active_order_ids:
+                        del _notified_zero_above[oid]
 
     except Exception as exc:
         print(f"[monitor_single_bid_above] error: {exc}")
@@ -584,31 +701,38 @@ async def cancel_one_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     if update.effective_user.id != ALLOWED_USER_ID:
         return
 
-    order_id = query.data.split(":", 1)[1]
-    await query.edit_message_reply_markup(reply_markup=None)
-
-    try:
-        headers = await jwt_manager.get_headers()
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{PREDICT_BASE_URL}/v1/orders", headers=headers) as r:
-                data = (await r.json()).get("data", [])
+    with perf_cycle("cancel_one"):
+        order_id = query.data.split(":", 1)[1]
+        with perf_span("send"):
+            await query.edit_message_reply_markup(reply_markup=None)
 
-        # Ищем нужный ордер по id/hash
-        target = next(
-            (o for o in data if str(o.get("id") or o.get("hash")) == order_id),
-            None,
-        )
-        if target is None:
-            await query.message.reply_text(f"⚠️ Ордер <code>{html.escape(order_id)}</code> не найден.", parse_mode="HTML")
-            return
+        try:
+            with perf_span("jwt"):
+                headers = await jwt_manager.get_headers()
+            with perf_span("orders"):
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(f"{PREDICT_BASE_URL}/v1/orders", headers=headers) as r:
+                        data = (await r.json()).get("data", [])
+
+            # Ищем нужный ордер по id/hash
+            target = next(
+                (o for o in data if str(o.get("id") or o.get("hash")) == order_id),
+                None,
+            )
+            if target is None:
+                with perf_span("send"):
+                    await query.message.reply_text(f"⚠️ Ордер <code>{html.escape(order_id)}</code> не найден.", parse_mode="HTML")
+                return
 
-        ok = await cancel_orders_raw([target])
-        if ok:
-            await query.message.reply_text(f"✅ Ордер <code>{html.escape(order_id)}</code> отменён.", parse_mode="HTML")
-        else:
-            await query.message.reply_text(f"❌ Не удалось отменить ордер <code>{html.escape(order_id)}</code>.", parse_mode="HTML")
-    except Exception as exc:
-        await query.message.reply_text(f"❌ Ошибка: {exc}")
+            with perf_span("cancel"):
+                ok = await cancel_orders_raw([target])
+            with perf_span("send"):
+                if ok:
+                    await query.message.reply_text(f"✅ Ордер <code>{html.escape(order_id)}</code> отменён.", parse_mode="HTML")
+                else:
+                    await query.message.reply_text(f"❌ Не удалось отменить ордер <code>{html.escape(order_id)}</code>.", parse_mode="HTML")
+        except Exception as exc:
+            await query.message.reply_text(f"❌ Ошибка: {exc}")
 
 
 async def cancel_all_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -617,26 +741,86 @@ async def cancel_all_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     if update.effective_user.id != ALLOWED_USER_ID:
         return
 
-    await query.edit_message_reply_markup(reply_markup=None)
-    await query.message.reply_text("⏳ Отменяю все ордера...")
+    with perf_cycle("cancel_all"):
+        with perf_span("send"):
+            await query.edit_message_reply_markup(reply_markup=None)
+            await query.message.reply_text("⏳ Отменяю все ордера...")
+
+        try:
+            with perf_span("jwt"):
+                headers = await jwt_manager.get_headers()
+            with perf_span("orders"):
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(f"{PREDICT_BASE_URL}/v1/orders", headers=headers) as r:
+                        data = (await r.json()).get("data", [])
+
+            if not data:
+                with perf_span("send"):
+                    await query.message.reply_text("✅ Открытых ордеров нет.")
+                return
+
+            with perf_span("cancel"):
+                ok = await cancel_orders_raw(data)
+            with perf_span("send"):
+                if ok:
+                    await query.message.reply_text(f"✅ Все ордера ({len(data)} шт.) отменены!")
+                else:
+                    await query.message.reply_text("⚠️ Некоторые ордера не удалось отменить.")
+        except Exception as exc:
+            await query.message.reply_text(f"❌ Ошибка: {exc}")
+
 
+async def _run_profile(message, seconds: float):
+    """Фоновая задача для /perf profile: не блокирует обработку других апдейтов."""
+    global _perf_profiling
     try:
-        headers = await jwt_manager.get_headers()
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{PREDICT_BASE_URL}/v1/orders", headers=headers) as r:
-                data = (await r.json()).get("data", [])
+        await message.reply_text(f"Profiling for {seconds:.0f}s...")
+        collapsed = await asyncio.to_thread(sample_stacks, seconds)
+        if not collapsed:
+            await message.reply_text("No samples collected.")
+            return
+        filename = time.strftime("perf-%Y%m%d-%H%M%S.folded")
+        await message.reply_document(
+            document=io.BytesIO(collapsed.encode("utf-8")),
+            filename=filename,
+            caption="Collapsed stacks (flamegraph.pl / speedscope)",
+        )
+    except Exception as exc:
+        await message.reply_text(f"Error: {exc}")
+    finally:
+        _perf_profiling = False
 
-        if not data:
-            await query.message.reply_text("✅ Открытых ордеров нет.")
+
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/perf [N] — самые медленные циклы; /perf profile [сек] — сэмплирующий профайлер."""
+    global _perf_profiling
+    if update.effective_user.id != ALLOWED_USER_ID:
+        return  # молча игнорируем чужие запросы
+    args = context.args or []
+
+    if args and args[0] == "profile":
+        try:
+            seconds = float(args[1]) if len(args) > 1 else 10.0
+        except ValueError:
+            await update.message.reply_text("Usage: /perf profile [seconds]")
+            return
+        seconds = max(1.0, min(seconds, PERF_MAX_PROFILE_SECONDS))
+        if _perf_profiling:
+            await update.message.reply_text("Profiler is already running.")
             return
 
-        ok = await cancel_orders_raw(data)
-        if ok:
-            await query.message.reply_text(f"✅ Все ордера ({len(data)} шт.) отменены!")
-        else:
-            await query.message.reply_text("⚠️ Некоторые ордера не удалось отменить.")
-    except Exception as exc:
-        await query.message.reply_text(f"❌ Ошибка: {exc}")
+        _perf_profiling = True
+        context.application.create_task(_run_profile(update.message, seconds), update=update)
+        return
+
+    try:
+        limit = int(args[0]) if args else 5
+    except ValueError:
+        await update.message.reply_text("Usage: /perf [count] | /perf profile [seconds]")
+        return
+    await update.message.reply_text(format_perf_message(max(1, min(limit, 20))), parse_mode="HTML")
+
+
 def main() -> None:
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN (or TELEGRAM_TOKEN) is not set.")
@@ -656,6 +840,7 @@ def main() -> None:
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("orders", orders_command))
     app.add_handler(CommandHandler("bids", bids_command))
+    app.add_handler(CommandHandler("perf", perf_command))
     app.add_handler(CallbackQueryHandler(cancel_one_callback, pattern=r"^cancel_one:"))
     app.add_handler(CallbackQueryHandler(cancel_all_callback, pattern=r"^cancel_all$"))
 